@@ -10,11 +10,66 @@
 #   - LooRsq, EmpR, EmpRsq, Dose0, Dose1 (These seem to be NA for most samples)
 
 import pandas as pd
-import gzip
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.csv as pacsv # Parse .info.gz files in C instead of creating a Python string for every value
+from xopen import xopen # Uses isal (igzip) when available, faster than gzip
 import numpy as np
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor # Decompression and parsing release the GIL, so files can be read in parallel threads
+
+# Columns read from .info.gz files and their data types. Other columns in .info.gz files are not loaded
+# ALT_Frq, MAF and Rsq are read as float64. Combined values are written with %.6f and copied into the merged VCF,
+# and Rsq is compared with --r2_threshold, so float32 would change results (eg. 0.9 in float32 is 0.89999998 < 0.9)
+# REF(0) and ALT(1) have only a few distinct values, read them as categories (dictionary encoded)
+# to reduce memory usage and speed up merging
+# Genotyped is kept as strings: get_genotype_status() works row-wise across files, which is very slow on categories
+LST_CATEGORY_COLS = ['REF(0)', 'ALT(1)']
+LST_NUMERIC_COLS = ['ALT_Frq', 'MAF', 'Rsq']
+DICT_INFO_COL_TYPES = {'SNP': pa.string(), 'REF(0)': pa.dictionary(pa.int32(), pa.string()),
+                       'ALT(1)': pa.dictionary(pa.int32(), pa.string()), 'Genotyped': pa.string(),
+                       'ALT_Frq': pa.float64(), 'MAF': pa.float64(), 'Rsq': pa.float64()}
+
+# This function reads columns of a .info.gz file into a pyarrow Table
+# Parameters:
+# - info_fn: name of the .info.gz file
+# - convert_options: pyarrow.csv.ConvertOptions with columns to be read and their data types
+def __read_info_table(info_fn, convert_options):
+    parse_options = pacsv.ParseOptions(delimiter='\t')
+    with pa.input_stream(info_fn, compression='gzip') as fh:
+        return pacsv.read_csv(fh, parse_options=parse_options, convert_options=convert_options)
+
+
+# This function reads one .info.gz file into a DataFrame
+# Parameter:
+# - info_fn: name of the .info.gz file
+def __read_info_file(info_fn):
+    # ALT_Frq, MAF and Rsq are parsed as numbers directly. Non-numeric values such as '-' or '.' are treated as missing values
+    convert_options = pacsv.ConvertOptions(column_types=DICT_INFO_COL_TYPES, include_columns=list(DICT_INFO_COL_TYPES),
+                                           null_values=pacsv.ConvertOptions().null_values + ['-', '.'])
+    try:
+        try:
+            return __read_info_table(info_fn, convert_options).to_pandas()
+        except pa.ArrowInvalid:
+            # Other non-numeric values (eg. 'x') cannot be parsed as numbers. Read ALT_Frq, MAF and Rsq as strings instead,
+            # and convert them with pd.to_numeric(errors='coerce'), so that these values become missing values
+            dict_col_types = dict(DICT_INFO_COL_TYPES, **{col: pa.string() for col in LST_NUMERIC_COLS})
+            convert_options = pacsv.ConvertOptions(column_types=dict_col_types, include_columns=list(DICT_INFO_COL_TYPES))
+            df = __read_info_table(info_fn, convert_options).to_pandas()
+            for col in LST_NUMERIC_COLS:
+                df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+            return df
+    except FileNotFoundError:
+        print('Error: File not found:', info_fn, '\n')
+        raise IOError('File not found: ' + info_fn)
+    except OSError as e: # Such as a file not compressed by gzip
+        print('Error: Cannot read file:', info_fn, '(' + str(e) + ')\n')
+        raise
+
 
 # This function returns a list of DataFrames read from .info.gz files
+# Files are read in parallel, use up to dict_flags['--thread'] threads
 # Parameter:
 # - dict_flag: a dictionary containing flags and values. Such as '--missing':1, etc.
 def __get_lst_info_df(dict_flags):
@@ -24,15 +79,15 @@ def __get_lst_info_df(dict_flags):
     for fn in dict_flags['--info']:
         print('\t' + fn)
 
-    lst_info_df = []  # A list to store .info.gz DataFrames
-    for info_fn in dict_flags['--info']:
-        try:
-            # Read in as string data type to avoid low memory warning (convert to numeric later)
-            df = pd.read_csv(info_fn, sep='\t', compression='gzip', dtype='str')
-            lst_info_df.append(df)
-        except:
-            print('Error: File not found:', info_fn, '\n')
-            raise IOError('File not found: ' + info_fn)
+    # A list to store .info.gz DataFrames, in the same order as dict_flags['--info']
+    with ThreadPoolExecutor(max_workers=min(len(dict_flags['--info']), dict_flags['--thread'])) as executor:
+        lst_info_df = list(executor.map(__read_info_file, dict_flags['--info']))
+
+    # Use the same categories in all files, so that category columns can be merged without converting back to strings
+    for col in LST_CATEGORY_COLS:
+        categories = union_categoricals([df[col] for df in lst_info_df]).categories
+        for df in lst_info_df:
+            df[col] = df[col].cat.set_categories(categories)
     return lst_info_df
 
 # This function merge all .info.gz files (outer merge) into a master Dataframe
@@ -43,47 +98,62 @@ def __get_lst_info_df(dict_flags):
 #                 Info files generated from make_info.py follow this naming style
 # Return: a Dataframe with all variants and columns REF(0), ALT(1), Genotyped, ALT_Frq, MAF and Rsq
 # - For duplicated fields MAF and Rsq, column are renamed as MAF_group1, Rsq_group1, etc
+# - Variants are sorted by POS, SNP and index in each input file
 # - lst_index_col_names: a list to store index column names of each dataframe, such as [index_group1, index_group2, ...]
 def __merge_snps(lst_info_df, cols_to_keep=['SNP', 'REF(0)', 'ALT(1)', 'Genotyped', 'ALT_Frq', 'MAF', 'Rsq']):
     # Only need these columns to merge
-    i = 0
-    df_merged = '' # A DataFrame of merged .info.gz df
-    lst_index_col_names = [] # A list to store column names of index columns
+    # Need to merge on multiple keys: ['SNP', 'POS', 'REF(0)', 'ALT(1)']
+    # Otherwise will be NAs if a variant is not found in the first info file
+    lst_key_cols = ['SNP', 'POS', 'REF(0)', 'ALT(1)']
+    lst_index_col_names = ['index_group'+str(i+1) for i in range(len(lst_info_df))] # A list to store column names of index columns
 
     # Create POS column to merge on, since SNP in different files may have flipped REF and ALT, but POS is always the same
-    # Convert MAF, Alt_frq and Rsq to numeric
-    col_name_alt_frq, col_name_maf, col_name_r2 = cols_to_keep[-3:]
+    # (MAF, Alt_frq and Rsq are already numeric when read by __get_lst_info_df())
     for df in lst_info_df:
         df['POS'] = df['SNP'].apply(lambda x: int(x.split(':')[1]))
-        df[col_name_alt_frq] = pd.to_numeric(df[col_name_alt_frq], errors='coerce')
-        df[col_name_maf] = pd.to_numeric(df[col_name_maf], errors='coerce')
-        df[col_name_r2] = pd.to_numeric(df[col_name_r2], errors='coerce')
-
-    while i<len(lst_info_df):
-        if i==0: # Merge the 1st and 2nd df
-            # Need to merge on multiple keys: ['SNP', 'REF(0)', 'ALT(1)','Genotyped']
-            # Otherwise will be NAs if a variant is not found in the first info file
-            # Use reset_index() to track index number of a variant in each input file
-            # Eg. variant rs0000 is from row index 1 in input file 1 and row #3 in input file 2
-            df_merged = lst_info_df[i][cols_to_keep+['POS']].reset_index().merge(lst_info_df[i+1][cols_to_keep+['POS']].reset_index(),
-                                                           how='outer',
-                                                           on=['SNP', 'POS', 'REF(0)', 'ALT(1)'],
-                                                           suffixes=('_group'+str(i+1), '_group'+str(i+2)))
-
-            lst_index_col_names.append('index_group'+str(i+1))
-            lst_index_col_names.append('index_group'+str(i+2))
-            i = i + 2
-        else:
-            # Merge and rename columns of df with correct suffix (ie. _groupX)
-            df_merged = df_merged.merge(lst_info_df[i][cols_to_keep+['POS']].reset_index().rename(columns={'MAF':'MAF_group'+str(i+1),
-                                                                                                           'Rsq':'Rsq_group'+str(i+1),
-                                                                                                           'ALT_Frq':'ALT_Frq_group'+str(i+1),
-                                                                                                           'Genotyped':'Genotyped_group' + str(i+1),
-                                                                                                           'index':'index_group' + str(i+1)}),
-                                        how='outer',
-                                        on=['SNP', 'POS', 'REF(0)', 'ALT(1)'])
-            lst_index_col_names.append('index_group' + str(i+1))
-            i += 1
+
+    # Merge keys are used as index of each df, to find variants shared by input files
+    lst_df_to_merge = []
+    for i in range(len(lst_info_df)):
+        df = lst_info_df[i][cols_to_keep+['POS']].set_index(lst_key_cols)
+        if not df.index.is_unique:
+            print('Error: Duplicated variants (same SNP, REF(0) and ALT(1)) are found in info file #' + str(i+1) + '\n')
+            raise ValueError('Duplicated variants in info file #' + str(i+1))
+        lst_df_to_merge.append(df)
+
+    # Outer merge all input files at once: get union of variants from all files,
+    # then align each df to the union (missing variants are NaN) and combine columns side by side.
+    # This avoids merging and copying the growing merged DataFrame once for every input file
+    # Keys of all files are appended and deduplicated in one pass (one hash table), instead of a union for every file
+    union_index = lst_df_to_merge[0].index.append([df.index for df in lst_df_to_merge[1:]]).unique()
+
+    # Index of a variant in each file is its row position in that file (-1 if missing)
+    # Computed once per file, and reused to sort variants, to fill index_groupX and to take rows of each file
+    lst_indexer = [df.index.get_indexer(union_index) for df in lst_df_to_merge]
+
+    # Sort variants by position and index in each input file, since there could be multiple variants at the same position
+    # Merged variants are created in this order, so they do not need to be sorted again before saving
+    # Missing indices are sorted last
+    # np.lexsort: the last key is the primary key
+    int32_max = np.iinfo(np.int32).max
+    lst_sort_keys = [np.where(arr_inx < 0, int32_max, arr_inx) for arr_inx in lst_indexer[::-1]]
+    lst_sort_keys += [union_index.get_level_values('SNP').to_numpy(), union_index.get_level_values('POS').to_numpy()]
+    arr_order = np.lexsort(lst_sort_keys)
+    union_index = union_index[arr_order]
+    lst_indexer = [arr_inx[arr_order] for arr_inx in lst_indexer]
+
+    # Take rows of each file by its indexer (missing variants are NaN), columns are renamed with correct suffix (ie. _groupX)
+    # Track index number (row position) of a variant in each input file with column index_groupX
+    # Eg. variant rs0000 is from row index 1 in input file 1 and row #3 in input file 2
+    # Use nullable Int32, so that columns stay integers (not promoted to float64) when a variant is missing from some files
+    dict_merged_cols = {}
+    for i in range(len(lst_df_to_merge)):
+        df, arr_inx = lst_df_to_merge[i], lst_indexer[i]
+        for col in df.columns:
+            dict_merged_cols[col+'_group'+str(i+1)] = df[col].array.take(arr_inx, allow_fill=True)
+        dict_merged_cols[lst_index_col_names[i]] = pd.arrays.IntegerArray(arr_inx.astype(np.int32), arr_inx < 0)
+    df_merged = pd.DataFrame(dict_merged_cols, index=union_index).reset_index()
+
     # Get chr from snp IDs, maybe add this feature in the future
     # df_merged['chr'] = df_merged['SNP'].apply(lambda x: x.split(':')[0])
     return df_merged, lst_index_col_names
@@ -129,6 +199,41 @@ def get_genotype_status(df, mixed_genotype, genotyped_labels, imputed_labels, nu
     df.drop(columns=lst_genotype_col_names, inplace=True)
 
 
+# This function counts number of individuals in a .dose.vcf.gz file (number of columns after FORMAT in the header line)
+# Parameter:
+# - fn: name of the .dose.vcf.gz file
+def __count_individuals(fn):
+    # Read as bytes in 256 KiB blocks and search for the column header line (starts with #CHROM),
+    # instead of reading and checking header lines (start with ##) one by one. Stop reading once the line is found,
+    # or once a line not starting with '#' is found (ie. no column header line before data lines)
+    block_size = 256*1024
+    buf = bytearray(b'\n') # Start with a new line character, so the column header line is found even if it is the first line
+    inx_start, inx_end = -1, -1 # Start and end positions of the column header line in buf
+    with xopen(fn, 'rb', threads=0) as fh:
+        while inx_end < 0:
+            block = fh.read(block_size)
+            if not block: # End of file
+                break
+            buf += block
+            if inx_start < 0:
+                # Only search the new block (and the few bytes before it, in case '\n#CHROM' is split between blocks)
+                inx_search_from = max(0, len(buf)-len(block)-len(b'\n#CHROM'))
+                inx_start = buf.find(b'\n#CHROM', inx_search_from)
+                if inx_start < 0 and re.search(rb'\n[^#]', buf[inx_search_from:]):
+                    break # Reached data lines without finding the column header line
+            if inx_start >= 0:
+                inx_end = buf.find(b'\n', inx_start+1)
+    if inx_start < 0:
+        print('Error: Column header line (starts with #CHROM) is not found in', fn, '\n')
+        raise ValueError('Column header line (#CHROM) not found: ' + fn)
+    if inx_end < 0:
+        inx_end = len(buf)
+    lst_tmp = buf[inx_start+1:inx_end].split()
+    start_pos = lst_tmp.index(b'FORMAT')
+    total_len = len(lst_tmp)
+    return total_len-(start_pos+1)
+
+
 # This function calculated r2 (use method defined by dict_flags['--r2_output'])， MAF, and altFrq,
 # assign values to a column (col_name_r2_combined, col_name_maf_combined) in df_merged
 # Parameters:
@@ -142,55 +247,59 @@ def get_genotype_status(df, mixed_genotype, genotyped_labels, imputed_labels, nu
 #                  Defines how Rsq is calculated
 def __calculate_r2_maf_altFrq(df_merged, col_name_r2_combined,
                               col_name_maf_combined, col_name_alt_frq_combined, dict_flags):
-    lst_number_of_individuals = []  # A list to store number of individuals of each input file
-    # Count number of individuals in each input file
-    for fn in dict_flags['--input']:
-        with gzip.open(fn, 'rt') as fh:
-            line = fh.readline().strip()
-            while line[0:2]=='##':
-                line = fh.readline().strip() # Read and skip header lines
-            lst_tmp = line.split()
-            start_pos = lst_tmp.index('FORMAT')
-            total_len = len(lst_tmp)
-            lst_number_of_individuals.append(total_len-(start_pos+1))
+    # Count number of individuals in each input file (files are read in parallel)
+    # lst_number_of_individuals: A list to store number of individuals of each input file
+    with ThreadPoolExecutor(max_workers=min(len(dict_flags['--input']), dict_flags['--thread'])) as executor:
+        lst_number_of_individuals = list(executor.map(__count_individuals, dict_flags['--input']))
     if dict_flags['--retained_snp_list'] != 'None': # If retained SNP list is provided, no need to run rest of the function
         return lst_number_of_individuals
     
     # Calculate weighted r2 use this equation:
     # r2_combined = sum(r2_groupX * number_of_individuals_groupX) / sum(number_of_individuals_groupX)
-    lst_col_names_r2_adj = []   # A list to store column names of r2 * weight
-    lst_col_names_maf_adj = []  # For MAF, similar to lst_col_names_r2_adj
-    lst_col_names_alt_frq_adj = [] # For ALT_Frq, same calculation as MAF
-
-    # A list to store column names of r2 * weight/r2
-    # In this way weight can be adjusted to reflect missing values in r2
-    lst_col_names_weight_adj = []
-    lst_col_r2_names=[] # Store column names of r2 from each file, such as Rsq_group1, Rsq_group2 ...
+    # Weighted sums are accumulated one input file at a time into 1D float64 arrays (one value per variant),
+    # so that memory usage does not grow with number of input files, and no temporary columns are created
+    lst_col_r2_names = ['Rsq_group'+str(i+1) for i in range(len(dict_flags['--input']))] # Such as Rsq_group1, Rsq_group2 ...
+    number_of_variants = len(df_merged)
+    arr_weight_sum = np.zeros(number_of_variants)  # sum(number_of_individuals_groupX) of groups with valid, non-zero Rsq
+    arr_r2_weighted_sum = np.zeros(number_of_variants)
+    arr_maf_weighted_sum = np.zeros(number_of_variants)
+    arr_alt_frq_weighted_sum = np.zeros(number_of_variants)
+    arr_r2_sum = np.zeros(number_of_variants) # Unweighted sum and number of valid Rsq, used when --r2_output is mean
+    arr_r2_count = np.zeros(number_of_variants, dtype=np.int32)
     for i in range(len(dict_flags['--input'])):
-        col_name_r2 = 'Rsq_group'+str(i+1)
-        col_name_maf = 'MAF_group' + str(i+1)
-        col_name_alt_frq = 'ALT_Frq_group'+str(i+1)
-        lst_col_r2_names.append(col_name_r2)
-
-        # !!! Must use pd.DataFrame.sum(), mean(), etc. functions to deal with missing values (NaN)
-        # Otherwise will get NaN if adding NaN to another value directly.
-        df_merged[col_name_r2+'_adj'] = df_merged[col_name_r2] * lst_number_of_individuals[i] # Rsq * # individuals
-        df_merged[col_name_maf+'_adj'] = df_merged[col_name_maf] * lst_number_of_individuals[i]   # MAF * # individuals
-        df_merged[col_name_alt_frq + '_adj'] = df_merged[col_name_alt_frq] * lst_number_of_individuals[i]  # MAF * # individuals
+        # Products with weight are calculated (dtype=np.float64) and accumulated in float64
+        weight = float(lst_number_of_individuals[i])
+        arr_r2 = df_merged['Rsq_group'+str(i+1)].to_numpy(dtype=np.float64)
+        arr_maf = df_merged['MAF_group'+str(i+1)].to_numpy(dtype=np.float64)
+        arr_alt_frq = df_merged['ALT_Frq_group'+str(i+1)].to_numpy(dtype=np.float64)
 
         # Weight is number of individuals (but not include missing values)
-        # Code below reflects missing values by * and / the same values (Rsq)
-        # Missing values are not counted when calculate weighted Rsq, MAF and AF (so use if for all!)
-        df_merged[col_name_r2 + '_weight_adj'] = lst_number_of_individuals[i] * df_merged[col_name_r2]/ df_merged[col_name_r2]
-        lst_col_names_r2_adj.append(col_name_r2+'_adj')
-        lst_col_names_maf_adj.append(col_name_maf + '_adj')
-        lst_col_names_alt_frq_adj.append(col_name_alt_frq + '_adj')
-        lst_col_names_weight_adj.append(col_name_r2 + '_weight_adj')
-
-    df_merged[col_name_alt_frq_combined] = df_merged[lst_col_names_alt_frq_adj].sum(axis=1) / df_merged[lst_col_names_weight_adj].sum(axis=1)
-    df_merged[col_name_maf_combined] = df_merged[lst_col_names_maf_adj].sum(axis=1) / df_merged[lst_col_names_weight_adj].sum(axis=1)
+        # Missing values of Rsq are not counted when calculate weighted Rsq, MAF and AF (so use if for all!)
+        # Same as weight * Rsq / Rsq used before, weight is not counted when Rsq is 0 either (0/0 is NaN)
+        # !!! Use where= to skip missing values (NaN), otherwise will get NaN if adding NaN to another value directly.
+        arr_valid_r2 = ~np.isnan(arr_r2)
+        np.add(arr_weight_sum, weight, out=arr_weight_sum, where=arr_valid_r2 & (arr_r2 != 0)) # Add weight only where Rsq is valid and not 0
+        np.add(arr_r2_weighted_sum, np.multiply(arr_r2, weight, dtype=np.float64),
+               out=arr_r2_weighted_sum, where=arr_valid_r2)
+        np.add(arr_maf_weighted_sum, np.multiply(arr_maf, weight, dtype=np.float64),
+               out=arr_maf_weighted_sum, where=~np.isnan(arr_maf))
+        np.add(arr_alt_frq_weighted_sum, np.multiply(arr_alt_frq, weight, dtype=np.float64),
+               out=arr_alt_frq_weighted_sum, where=~np.isnan(arr_alt_frq))
+        if dict_flags['--r2_output'] == 'mean':
+            np.add(arr_r2_sum, arr_r2, out=arr_r2_sum, where=arr_valid_r2)
+            arr_r2_count += arr_valid_r2
+
+    # Calculate 1/sum(weight) once, weighted averages below multiply by it instead of dividing by sum(weight) each time
+    # Variants without any valid Rsq get NaN (0 * inf), same as before (0/0)
+    with np.errstate(divide='ignore'):
+        arr_weight_sum_inv = 1.0 / arr_weight_sum
+
+    with np.errstate(invalid='ignore'):
+        df_merged[col_name_alt_frq_combined] = arr_alt_frq_weighted_sum * arr_weight_sum_inv
+        df_merged[col_name_maf_combined] = arr_maf_weighted_sum * arr_weight_sum_inv
     if dict_flags['--r2_output'] == 'weighted_average': # ie. dict_flags['--r2_output']=='weighted_average'
-        df_merged[col_name_r2_combined] = df_merged[lst_col_names_r2_adj].sum(axis=1) / df_merged[lst_col_names_weight_adj].sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            df_merged[col_name_r2_combined] = arr_r2_weighted_sum * arr_weight_sum_inv
     elif dict_flags['--r2_output'] == 'z_transformation': # Fisher's z-transformation
         # Fisher's z-transformation -> weighted average -> tanh
         # z transformation: 0.5 * np.log((1 + r2) / (1 - r2))
@@ -211,26 +320,35 @@ def __calculate_r2_maf_altFrq(df_merged, col_name_r2_combined,
             df_merged[col_name_r2 + '_z_trans_weight_adj'] = df_merged[col_name_r2+'_z_trans'] * lst_number_of_individuals[i] # Z_transed_r * weight
             lst_col_names_r2_z_trans.append(col_name_r2 + '_z_trans')
             lst_col_names_r2_z_trans_weight_adj.append(col_name_r2 + '_z_trans_weight_adj')
-        df_merged['R_z_trans_combined'] = df_merged[lst_col_names_r2_z_trans_weight_adj].sum(axis=1) / df_merged[lst_col_names_weight_adj].sum(axis=1)
+        df_merged['R_z_trans_combined'] = df_merged[lst_col_names_r2_z_trans_weight_adj].sum(axis=1) * arr_weight_sum_inv
         df_merged[col_name_r2_combined] = (np.tanh(df_merged['R_z_trans_combined']))**2
         df_merged['var_of_z_trans_r'] = df_merged[lst_col_names_r2_z_trans].var(axis=1) # variance of z transformed R
     elif dict_flags['--r2_output'] == 'first': # ie. dict_flags['--r2_output']=='first'
         df_merged[col_name_r2_combined] = df_merged['Rsq_group1']
     elif dict_flags['--r2_output'] == 'mean':
-        df_merged[col_name_r2_combined] = df_merged[lst_col_r2_names].mean(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df_merged[col_name_r2_combined] = arr_r2_sum / arr_r2_count
     elif dict_flags['--r2_output'] == 'min':  # ie. dict_flags['--r2_output']=='min'
         df_merged[col_name_r2_combined] = df_merged[lst_col_r2_names].min(axis=1)
     else:  # ie. dict_flags['--r2_output']=='max'
         df_merged[col_name_r2_combined] = df_merged[lst_col_r2_names].max(axis=1)
-
-    # Drop columns that are not needed in output
-    df_merged.drop(labels=lst_col_names_r2_adj, axis=1, inplace=True)
-    df_merged.drop(labels=lst_col_names_maf_adj, axis=1, inplace=True)
-    df_merged.drop(labels=lst_col_names_alt_frq_adj, axis=1, inplace=True)
-    df_merged.drop(labels=lst_col_names_weight_adj, axis=1, inplace=True)
     return lst_number_of_individuals    # Return number of individuals in each file
 
 
+# This function writes selected variants into a tab-delimited .txt file
+# pandas to_csv() is used (instead of pyarrow.csv.write_csv()) since missing values must be written as --na_rep
+# and float values formatted as %.6f, merge_files.py reads values in *_variants_retained.info.txt in this format
+# Parameters:
+#  - df: A DataFrame of variants to be saved (only columns to be written)
+#  - fn: Name of output file
+#  - na_rep: Symbol of missing values (dict_flags['--na_rep'])
+def __write_variants(df, fn, na_rep):
+    # Use %g for precision formatting, will get a mix of scientific notation when number is too small
+    # Or use %.6f, for 6 precision after dot. But if value is stoo small will be round to 0
+    float_format = '%.6f'
+    df.to_csv(fn, index=False, sep='\t', na_rep=na_rep, float_format=float_format)
+
+
 # This function save excluded and kept variants into .txt files
 # Parameters:
 #  - df_merged: A DataFrame of variants from all input files with desired fields
@@ -242,39 +360,22 @@ def __process_output(df_merged, dict_flags, lst_index_col_names):
     # Set output file names
     to_keep_fn = dict_flags['--output']+'_variants_retained.info.txt'
     to_exclude_fn = dict_flags['--output']+'_variants_excluded.info.txt'
-    mask_to_keep, mask_to_exclude = '', ''   # Use this when --missing is 0
-
-    lst_col_names = []  # A list to store column names of Rsq (such as Rsq_group1, Rsq_group2, etc.)
-    lst_genotype_status = []
-    for i in range(len(dict_flags['--input'])):
-        col_name_r2 = 'Rsq_group' + str(i + 1)
-        # col_name_genotype = 'Genotyped_group' + str(i + 1) # Genotype status
-        # lst_genotype_status.append(col_name_genotype)
-
-        # col_name_maf = 'MAF_group' + str(i + 1)
-        # col_name_alt_frq = 'ALT_Frq_group' + str(i + 1) # Column name of alternative allele
-        # # Convert values of r2, MAF and ALT_Frq columns from strings to numbers for later calculations
-        # df_merged[col_name_r2] = pd.to_numeric(df_merged[col_name_r2], errors='coerce')
-        # df_merged[col_name_maf] = pd.to_numeric(df_merged[col_name_maf], errors='coerce')
-        # df_merged[col_name_alt_frq] = pd.to_numeric(df_merged[col_name_alt_frq], errors='coerce')
-
-        # Process retained and excluded SNPs
-        if dict_flags['--missing'] == 0:  # If only save variants shared by all input files
-            # Check columns of Rsq (MAF also works) such as: Rsq_group1, Rsq_group2,...
-            # If MAF_groupX is NaN, then this variant is missing from the corresponding groupX.
-            if i == 0:  # If the first iteration
-                mask_to_keep = df_merged[col_name_r2].notna()
-                mask_to_exclude = df_merged[col_name_r2].isna()
-            else: # Add additional mask in each iteration
-                mask_to_keep = mask_to_keep & df_merged[col_name_r2].notna()
-                mask_to_exclude = mask_to_exclude | df_merged[col_name_r2].isna()
-
-            # Check if need to filter for SNPs using given r2 threshold
-            if dict_flags['--r2_threshold'] != 0:
-                mask_to_keep = mask_to_keep & (df_merged[col_name_r2] >= dict_flags['--r2_threshold'])
-                mask_to_exclude = mask_to_exclude | (df_merged[col_name_r2] < dict_flags['--r2_threshold'])
-
-        lst_col_names.append(col_name_r2)  # Save column names of Rsq_group1, Rsq_group2, etc.
+    # A list to store column names of Rsq (such as Rsq_group1, Rsq_group2, etc.)
+    lst_col_names = ['Rsq_group' + str(i + 1) for i in range(len(dict_flags['--input']))]
+    # Rsq columns are copied once into a C-contiguous (row-major) array, so each row is read from contiguous memory
+    arr_r2 = np.ascontiguousarray(df_merged[lst_col_names].to_numpy(dtype=np.float64))
+
+    # Process retained and excluded SNPs
+    if dict_flags['--missing'] == 0:  # If only save variants shared by all input files
+        # Check columns of Rsq (MAF also works) such as: Rsq_group1, Rsq_group2,...
+        # If Rsq_groupX is NaN, then this variant is missing from the corresponding groupX.
+        # Check all input files at once: keep a variant only if it is valid in every file
+        arr_valid = ~np.isnan(arr_r2)
+        # Check if need to filter for SNPs using given r2 threshold (NaN >= threshold is False)
+        if dict_flags['--r2_threshold'] != 0:
+            arr_valid &= (arr_r2 >= dict_flags['--r2_threshold'])
+        mask_to_keep = arr_valid.all(axis=1)
+        mask_to_exclude = ~mask_to_keep
 
     # Determine genotype status: ALL=All genotyped, SOME=Some genotype, NONE=none genotyped
     get_genotype_status(df_merged, dict_flags['--mixed_genotype_status'], dict_flags['--genotyped_label'],
@@ -289,58 +390,57 @@ def __process_output(df_merged, dict_flags, lst_index_col_names):
                                                           col_name_maf_combined, col_name_alt_frq_combined, dict_flags)
 
     # Save result to output files
-    float_format = '%.6f'
+    # Index columns and POS are only used for sorting. Select the rest of columns together with rows,
+    # instead of copying the selected rows and then copying them again with drop(columns=...)
+    set_cols_not_to_output = set(lst_index_col_names+['POS'])
+    arr_output_col_inx = np.array([i for i, col in enumerate(df_merged.columns) if col not in set_cols_not_to_output])
     if dict_flags['--missing'] == 0:
-        # Use %g for precision formatting, will get a mix of scientific notation when number is too small
-        # Or use %.6f, for 6 precision after dot. But if value is stoo small will be round to 0
         # Save to *.variant_retained.info.txt sorted by position and index in each input file,
         # since there could be multiple variants at the same position
-        df_merged[mask_to_keep].sort_values(by=['POS', 'SNP']+lst_index_col_names)\
-            .drop(columns=lst_index_col_names+['POS'])\
-            .to_csv(to_keep_fn, index=False, sep='\t', na_rep=dict_flags['--na_rep'], float_format=float_format)
-        df_merged[mask_to_exclude].drop(columns=lst_index_col_names+['POS']).to_csv(to_exclude_fn, index=False,
-                                                                                           sep='\t', na_rep=dict_flags['--na_rep'],
-                                                                                           float_format=float_format)
-        print('\tNumber of saved variants:', len(df_merged[mask_to_keep]))
-        print('\tNumber of excluded variants:', len(df_merged[mask_to_exclude]))
+        # Positional indices of retained and excluded variants (already sorted by __merge_snps())
+        arr_inx_to_keep = np.flatnonzero(mask_to_keep)
+        arr_inx_to_exclude = np.flatnonzero(mask_to_exclude)
+        __write_variants(df_merged.iloc[arr_inx_to_keep, arr_output_col_inx], to_keep_fn, dict_flags['--na_rep'])
+        __write_variants(df_merged.iloc[arr_inx_to_exclude, arr_output_col_inx], to_exclude_fn, dict_flags['--na_rep'])
+        print('\tNumber of saved variants:', len(arr_inx_to_keep))
+        print('\tNumber of excluded variants:', len(arr_inx_to_exclude))
 
         # Write important info into log file
         log_fn = dict_flags['--output'] + '.log'  # Save Important processing info into a .log file for user reference
         with open(log_fn, 'a') as log_fh:
             log_fh.write('\tTotal number of all input files combined: '+str(len(df_merged))+'\n')
-            log_fh.write('\tNumber of saved variants:'+str(len(df_merged[mask_to_keep]))+'\n')
-            log_fh.write('\tNumber of excluded variants:'+str(len(df_merged[mask_to_exclude]))+'\n')
+            log_fh.write('\tNumber of saved variants:'+str(len(arr_inx_to_keep))+'\n')
+            log_fh.write('\tNumber of excluded variants:'+str(len(arr_inx_to_exclude))+'\n')
     else:   # Use user specify allowed missingness, max value is number of input files
         # Calculate number of missing files (by number of NA value of Rsq column)
-        df_merged['missing'] = df_merged[lst_col_names].isna().sum(axis=1)
+        arr_missing = np.count_nonzero(np.isnan(arr_r2), axis=1)
 
         # Filter by dict_flags['--r2_threshold'], if merged Rsq>=dict_flags['--r2_threshold'] then keep this variant
         # Also filter by number of missing files (dict_flags['--missing'])
-        mask_to_keep = (df_merged['missing']<=dict_flags['--missing']) & \
-                       (df_merged[col_name_r2_combined]>=dict_flags['--r2_threshold'])
-        mask_to_exclude = (df_merged['missing']>dict_flags['--missing']) | \
-                          (df_merged[col_name_r2_combined]<dict_flags['--r2_threshold'])
+        arr_r2_combined = df_merged[col_name_r2_combined].to_numpy()
+        mask_to_keep = (arr_missing<=dict_flags['--missing']) & (arr_r2_combined>=dict_flags['--r2_threshold'])
+        mask_to_exclude = (arr_missing>dict_flags['--missing']) | (arr_r2_combined<dict_flags['--r2_threshold'])
 
-        df_merged.loc[mask_to_keep].sort_values(by=['POS', 'SNP']+lst_index_col_names)\
-                .drop(columns=lst_index_col_names+['POS', 'missing'])\
-                .to_csv(to_keep_fn, index=False, sep='\t', na_rep=dict_flags['--na_rep'], float_format=float_format)
-        df_merged.loc[mask_to_exclude].drop(columns=lst_index_col_names+['POS', 'missing'])\
-            .to_csv(to_exclude_fn, index=False, sep='\t', na_rep=dict_flags['--na_rep'], float_format=float_format)
+        # Positional indices of retained and excluded variants (already sorted by __merge_snps())
+        arr_inx_to_keep = np.flatnonzero(mask_to_keep)
+        arr_inx_to_exclude = np.flatnonzero(mask_to_exclude)
+        __write_variants(df_merged.iloc[arr_inx_to_keep, arr_output_col_inx], to_keep_fn, dict_flags['--na_rep'])
+        __write_variants(df_merged.iloc[arr_inx_to_exclude, arr_output_col_inx], to_exclude_fn, dict_flags['--na_rep'])
 
-        print('\tNumber of saved variants:', len(df_merged.loc[mask_to_keep]))
-        print('\tNumber of excluded variants:', len(df_merged.loc[mask_to_exclude]))
+        print('\tNumber of saved variants:', len(arr_inx_to_keep))
+        print('\tNumber of excluded variants:', len(arr_inx_to_exclude))
 
         # Write important info into log file
         log_fn = dict_flags['--output'] + '.log'  # Save Important processing info into a .log file for user reference
         with open(log_fn, 'a') as log_fh:
             log_fh.write('\tTotal number of all input files combined: '+str(len(df_merged))+'\n')
-            log_fh.write('\tNumber of saved variants: '+str(len(df_merged.loc[mask_to_keep]))+'\n')
-            log_fh.write('\tNumber of excluded variants: '+str(len(df_merged.loc[mask_to_exclude]))+'\n')
+            log_fh.write('\tNumber of saved variants: '+str(len(arr_inx_to_keep))+'\n')
+            log_fh.write('\tNumber of excluded variants: '+str(len(arr_inx_to_exclude))+'\n')
 
     # *.index.text is for debugging purpose, it is not needed in merge
     if dict_flags['--verbose']:
-        df_merged.sort_values(by=['POS', 'SNP']+lst_index_col_names)[['SNP']+lst_index_col_names].to_csv(dict_flags['--output']+'_index.txt',
-                                                                                              sep='\t', index=False, na_rep='-')
+        df_merged[['SNP']+lst_index_col_names].to_csv(dict_flags['--output']+'_index.txt',
+                                                                           sep='\t', index=False, na_rep='-')
     print('\nNumbers of individuals in each input file:', lst_number_of_individuals)
 
     # Write into a log file
@@ -348,7 +448,7 @@ def __process_output(df_merged, dict_flags, lst_index_col_names):
     with open(log_fn, 'a') as log_fh:
         log_fh.write('\nNumbers of individuals in each input file: '+str(lst_number_of_individuals))
 
-    return lst_number_of_individuals, len(df_merged[mask_to_keep]) # Return list of number of individuals and number of SNPs kept
+    return lst_number_of_individuals, len(arr_inx_to_keep) # Return list of number of individuals and number of SNPs kept
 # ---------------- End of helper functions -----------------
 
 # A wrapper function to run this script